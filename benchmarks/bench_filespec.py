@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+
+"""
+
+****************
+bench_filespec
+****************
+
+Description
+****************
+   Throughput benchmarks for the filespec module.
+
+   A synthetic spec file is generated in a temporary directory and the
+   different parsing paths are timed on it. Run it from the top directory
+   of the package:
+
+      python benchmarks/bench_filespec.py [-c channels] [-n points] [-s scans] [-r repeat]
+
+   Startup costs (module import and `specfile -l`) are measured by running
+   `repeat` fresh interpreters.
+
+"""
+
+import os
+import sys
+import time
+import getopt
+import random
+import shutil
+import tempfile
+import subprocess
+
+topdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, topdir)
+
+from specpython.filespec import FileSpec
+
+
+def writeSpecFile(filename, nscans, npoints, nchannels, linewidth=16):
+    ofd = open(filename, "w")
+    ofd.write("#F %s\n#E 1400000000\n#D Thu Jan  1 00:00:00 2015\n" % filename)
+    ofd.write("#C bench  User = bench\n#O0 th  tth  chi  phi\n\n")
+
+    for scanno in range(1, nscans + 1):
+        ofd.write("#S %d  ascan  th 0 1 %d 1\n" % (scanno, npoints - 1))
+        ofd.write("#D Thu Jan  1 00:00:00 2015\n#T 1  (Seconds)\n#P0 0 0 0 0\n")
+        ofd.write("#@MCA %dC\n#@CHANN %d 0 %d 1\n" % (linewidth, nchannels, nchannels - 1))
+        ofd.write("#N 3\n#L th  Monitor  Detector\n")
+        for pointno in range(npoints):
+            ofd.write("%g 1000 %d\n" % (pointno * 0.01, random.randint(0, 100000)))
+            values = ["%d" % random.randint(0, 5000) for chan in range(nchannels)]
+            lines = [" ".join(values[idx:idx + linewidth])
+                     for idx in range(0, nchannels, linewidth)]
+            ofd.write("@A " + "\\\n".join(lines) + "\n")
+        ofd.write("\n")
+
+    ofd.close()
+
+
+def legacyMcaDecode(lines):
+    # MCA decoding as done in McaData._addLine before the dedicated decoder
+    data = []
+    for line in lines:
+        if line.strip()[-1] == "\\":
+            dataline = line.strip()[:-1]
+        else:
+            dataline = line
+        data.extend(list(map(float, dataline.split())))
+    return data
+
+
+def mcaLines(scan):
+    # groups the @A lines of each spectrum as they are stored in the scan
+    spectra = []
+    current = None
+    for line in scan.lines:
+        if line[:2] == "@A":
+            current = [line[2:]]
+            spectra.append(current)
+        elif current is not None and line[0] != "#":
+            if current[-1][-1:] == "\\":
+                current.append(line)
+            else:
+                current = None
+    return spectra
+
+
+def timeit(func, *args):
+    t0 = time.time()
+    result = func(*args)
+    return time.time() - t0, result
+
+
+def benchMca(fs):
+    spectra = []
+    for scan in fs:
+        spectra.extend(mcaLines(scan))
+
+    nvalues = sum([len(" ".join(spectrum).split()) for spectrum in spectra])
+
+    elapsed, result = timeit(lambda: [legacyMcaDecode(spectrum) for spectrum in spectra])
+    report("mca decoding (legacy)", elapsed, nvalues, "values")
+
+    def decodeAll():
+        for scan in fs:
+            scan.resetParsedData()
+            for det_no in range(len(scan.getOneDDetectorNames())):
+                scan.getOneDDetector(det_no).getData()
+
+    # parsing is done first so that only decoding is timed. numpy is
+    # imported lazily by filespec, import time is measured in benchStartup
+    import numpy
+    for scan in fs:
+        scan.resetParsedData()
+        scan.parse()
+    elapsed, result = timeit(lambda: [[oned.getData() for oned in scan._oned_dets] for scan in fs])
+    report("mca decoding (decodeMca)", elapsed, nvalues, "values")
+
+    elapsed, result = timeit(decodeAll)
+    report("mca parse + decoding", elapsed, nvalues, "values")
+
+
+def runPython(args, repeat):
+    # best time out of `repeat` runs of a fresh interpreter
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.abspath(topdir)
+
+    devnull = open(os.devnull, "w")
+    best = None
+    try:
+        for runno in range(repeat):
+            t0 = time.time()
+            subprocess.call([sys.executable] + args, env=env, stdout=devnull)
+            elapsed = time.time() - t0
+            if best is None or elapsed < best:
+                best = elapsed
+    finally:
+        devnull.close()
+    return best
+
+
+def benchStartup(filename, repeat):
+    report("python startup", runPython(["-c", "pass"], repeat))
+    report("import numpy", runPython(["-c", "import numpy"], repeat))
+    report("import filespec", runPython(["-c", "import specpython.filespec"], repeat))
+    report("specfile -l", runPython([os.path.join(topdir, "specfile"), "-l", filename], repeat))
+
+
+def report(label, elapsed, count=None, units=None):
+    if count and elapsed > 0:
+        rate = "%12.0f %s/s" % (count / elapsed, units)
+    else:
+        rate = ""
+    print("%-30s %8.3f s %s" % (label, elapsed, rate))
+
+
+def main():
+    nchannels = 8192
+    npoints = 20
+    nscans = 5
+    repeat = 5
+
+    optlist, args = getopt.getopt(sys.argv[1:], "c:n:s:r:")
+    for o, a in optlist:
+        if o == "-c":
+            nchannels = int(a)
+        elif o == "-n":
+            npoints = int(a)
+        elif o == "-s":
+            nscans = int(a)
+        elif o == "-r":
+            repeat = int(a)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmpdir, "bench.dat")
+        writeSpecFile(filename, nscans, npoints, nchannels)
+        print("file: %d scans, %d points, %d channels, %d bytes" % (
+            nscans, npoints, nchannels, os.path.getsize(filename)))
+
+        elapsed, fs = timeit(FileSpec, filename)
+        report("indexing", elapsed, os.path.getsize(filename), "bytes")
+
+        benchMca(fs)
+        benchStartup(filename, repeat)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
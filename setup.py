@@ -10,7 +10,7 @@ setup(name="specpython",
    url = "http://www.certif.com",
    packages = ['specpython'],
    package_data = {'specpython': files},  
-   scripts = {"specfile"}, 
+   scripts = {"specfile", "specserver"}, 
    long_description = """
 This module gives full access to scans recorded in files writing with the spec file format.
 
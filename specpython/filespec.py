@@ -59,32 +59,199 @@ Description
 
 
 import re
-import numpy
 import os
 import sys
 import time
+import zlib
+import operator
+
+from array import array
+from collections import OrderedDict
+
+try:
+    _intern = intern
+except NameError:
+    _intern = sys.intern
 
 try:
-    from CSSLogger import dprint
-except ImportError:
-    dprint = str
+    _string_types = basestring
+except NameError:
+    _string_types = str
+
+# numpy is only needed by the methods returning arrays. it is imported the
+# first time one of them is called (see _importNumpy) so that tools only
+# listing or indexing files do not pay for it
+numpy = None
+
+
+def _importNumpy():
+    global numpy
+    if numpy is None:
+        import numpy
+    return numpy
+
+
+# name tuples (motors, counters) shared by all blocks using the same names
+# and the name -> position index for each of them
+_shared_names = {}
+_name_indexes = {}
+
+
+def _sharedNames(names):
+    key = tuple(names)
+    shared = _shared_names.get(key)
+    if shared is None:
+        shared = tuple([_intern(name) for name in names])
+        _shared_names[shared] = shared
+    return shared
+
+
+def _nameIndex(names):
+    index = _name_indexes.get(names)
+    if index is None:
+        index = dict([(name, idx) for idx, name in enumerate(names)])
+        _name_indexes[names] = index
+    return index
+
+
+def dprint(msg):
+    global dprint
+    try:
+        from CSSLogger import dprint
+    except ImportError:
+        dprint = str
+    return dprint(msg)
+
+# policies for errors in files (wrong lines or errors affecting a whole block):
+#   strict  - raise FileSpecError at the first error
+#   lenient - count errors by category and keep a bounded sample of them
+#   skip    - only count errors
+# errors are found when a block is parsed: file headers while indexing the
+# file, scans the first time their content is accessed
+ERROR_POLICIES = ["strict", "lenient", "skip"]
+
+# maximum number of erroneous lines recorded per block in lenient mode
+MAX_ERROR_SAMPLES = 20
+
+# number of decimations (points, column) kept for incremental updates in each scan.
+# least recently used ones are dropped
+DECIMATION_CACHE_SIZE = 4
+
+# number of scans, besides headers and the last block, whose boundaries are 
+# verified by FileSpec.update() when the file has grown
+UPDATE_SAMPLE_BLOCKS = 16
+
+
+class FileSpecError(Exception):
+    pass
+
+
+class ScanCollection:
+    """
+    Selection of scans and bulk data access, common to FileSpec and MultiFileSpec
+    """
+
+    def selectScans(self, selection):
+        """
+        Returns the list of scans for a scan selection. The selection can be a string with the
+        syntax used by the `specfile` script (see parseScanArgs) or a list of scan numbers
+        """
+        if isinstance(selection, _string_types):
+            selection = parseScanArgs(selection)
+
+        scans = []
+        for scanid in selection:
+            sparts = str(scanid).split(".")
+            try:
+                sno = int(sparts[0])
+                if len(sparts) > 1:
+                    sord = int(sparts[1])
+                else:
+                    sord = 0
+            except ValueError:
+                raise ValueError("Bad scan arguments %s" % scanid)
+
+            scan = self.getScanByNumber(sno, sord)
+            if scan is None:
+                raise ValueError("Cannot find scan %d(%d)" % (sno, sord))
+            scans.append(scan)
+
+        return scans
+
+    def getBulkData(self, selection, columns, padded=False, where=None):
+        """
+        Returns the data for the given columns (labels or column indices) in all selected scans
+        as a single numpy array. See selectScans for the syntax of the selection.
+
+        By default all rows are concatenated in a 2D array and a tuple (data, offsets) is returned
+        where rows for scan i are data[offsets[i]:offsets[i+1]].
+
+        If `padded` is True a 3D array with shape (scans, points, columns) is returned instead,
+        filled with NaN after the last point of each scan, together with the number of points in 
+        each scan: (data, lengths).
+
+        Columns not found in a scan are filled with NaN.  If `where` is given only the data points 
+        matching the conditions are returned (see Scan.getFilteredData). Only the values in the
+        requested columns are converted
+        """
+        _importNumpy()
+
+        if isinstance(columns, _string_types):
+            columns = [columns]
+
+        scans = self.selectScans(selection)
+        filtered = [scan._filteredData(columns, where) for scan in scans]
+        lengths = [len(scandata) for scandata in filtered]
+        ncols = len(columns)
+
+        if padded:
+            data = numpy.full((len(scans), max(lengths or [0]), ncols), numpy.nan)
+        else:
+            offsets = numpy.zeros(len(scans) + 1, dtype=int)
+            numpy.cumsum(lengths, out=offsets[1:])
+            data = numpy.empty((offsets[-1], ncols))
 
-class FileSpec(list):
+        for scanidx, scandata in enumerate(filtered):
+            if padded:
+                data[scanidx, :lengths[scanidx]] = scandata
+            else:
+                data[offsets[scanidx]:offsets[scanidx + 1]] = scandata
+
+        if padded:
+            return data, numpy.array(lengths, dtype=int)
+        else:
+            return data, offsets
+
+
+class FileSpec(ScanCollection, list):
     """
     FileSpec class documentation
+
+    `errors` is the policy for errors found in the file ("strict", "lenient" or "skip").
+    Scans are only parsed when their content is first accessed, so with "strict" a
+    FileSpecError is raised while indexing only for errors in file headers. Errors in
+    a scan raise when the scan is parsed. Call getErrorCounts() to parse and check
+    the whole file at once
     """
 
-    def __init__(self, filename):
+    def __init__(self, filename, errors="lenient"):
 
         list.__init__(self)
 
+        if errors not in ERROR_POLICIES:
+            raise ValueError("wrong error policy %s. Valid policies are %s" % (errors, ",".join(ERROR_POLICIES)))
+
         self.filename = filename
+        self.errors = errors
         self.origfilename = None
         self.headers = []
         self.lastpos = 0
 
         self.inheader = False
 
+        # block where indexing continues when the file grows
+        self._lastblock = None
+
         self.filestat = os.stat(self.filename)
         self.st_size = 0
 
@@ -96,18 +263,120 @@ class FileSpec(list):
     def absolutePath(self):
         return os.path.abspath(self.filename)
 
-    def update(self):
-
+    def update(self, verify=False):
+        """
+        Indexes the file again if it has changed. Returns True if the file was modified.
+
+        Data appended to the file is indexed incrementally. If the file was rewritten (replaced by 
+        another file, shrunk, or modified without growing) the blocks in the file are verified and 
+        only the blocks from the first modified one on are indexed again.
+
+        By default, when the file grows, the boundaries (see verify()) of the file headers, the last
+        block and a sample of UPDATE_SAMPLE_BLOCKS scans spread over the file are verified. A file
+        rewritten in place with equal or larger size is NOT detected unless the change moves or
+        alters one of those boundaries: a change inside a block that keeps its length (a value
+        replaced by another one of the same width) is never detected this way. With verify=True 
+        the boundaries of all blocks are verified, and with verify="full" the checksums for the 
+        whole content of all blocks, which detects any change
+        """
         currstat = os.stat(self.filename)
 
-        if currstat.st_size > self.st_size:
-            self.st_size = currstat.st_size
+        if (currstat.st_dev, currstat.st_ino) != (self.filestat.st_dev, self.filestat.st_ino):
+            # file replaced
+            self.filestat = currstat
+            self._reset()
             self._indexscans()
-            modified = True
+            return True
+
+        unchanged = (currstat.st_size == self.lastpos and currstat.st_mtime == self.filestat.st_mtime)
+        if unchanged and not verify:
+            return False
+
+        if verify:
+            block = self.verify(full=(verify == "full"))
+        elif currstat.st_size > self.lastpos:
+            block = self._verifyBlocks(self._updateSample(), False)
+        else:
+            # same size or smaller but modified. rewritten in place
+            block = self.verify()
+
+        self.filestat = currstat
+
+        if block is not None:
+            self._truncate(block)
+        elif currstat.st_size == self.lastpos:
+            return False
+
+        self.st_size = currstat.st_size
+        self._indexscans()
+        return True
+
+    def verify(self, full=False):
+        """
+        Verifies that the blocks indexed have not changed in the file. Returns the first modified 
+        block or None if all blocks are unchanged.
+
+        By default only the boundaries of the blocks are verified: the first line of each block 
+        and the checksum of its last non empty line. If `full` is True the checksum of the whole 
+        content of each block is verified
+        """
+        blocks = sorted(self.headers + list(self), key=lambda block: block.start)
+        return self._verifyBlocks(blocks, full)
+
+    def _updateSample(self):
+        # blocks verified when the file grows: headers, last block and scans spread over the file
+        blocks = list(self.headers)
+        nscans = len(self)
+        if nscans > UPDATE_SAMPLE_BLOCKS:
+            step = nscans / float(UPDATE_SAMPLE_BLOCKS)
+            blocks.extend([self[int(idx * step)] for idx in range(UPDATE_SAMPLE_BLOCKS)])
+        else:
+            blocks.extend(self)
+        if self._lastblock is not None:
+            blocks.append(self._lastblock)
+
+        return sorted(set(blocks), key=lambda block: block.start)
+
+    def _verifyBlocks(self, blocks, full):
+        fd = open(self.filename, "rb")
+        try:
+            for block in blocks:
+                if block is not None and not block._verify(fd, full):
+                    return block
+        finally:
+            fd.close()
+        return None
+
+    def _truncate(self, block):
+        # drops all blocks from `block` on, so that they are indexed again
+        start = block.start
+
+        self[:] = [scan for scan in self if scan.start < start]
+        self.headers = [header for header in self.headers if header.start < start]
+
+        remaining = self.headers + list(self)
+        if remaining:
+            self._lastblock = max(remaining, key=lambda block: block.start)
+            self.inheader = isinstance(self._lastblock, Header)
+        else:
+            self._lastblock = None
+            self.inheader = False
+
+        if self.headers:
+            self.origfilename = self.headers[-1]._filename or None
         else:
-            modified = False
+            self.origfilename = None
+
+        self.lastpos = start
 
-        return modified
+    def _reset(self):
+        del self[:]
+        self.headers = []
+        self.scans = {}
+        self.lastpos = 0
+        self.inheader = False
+        self.origfilename = None
+        self._lastblock = None
 
     def getScanByNumber(self, scanno, scanorder=0):
         if scanno in self.scans:
@@ -142,6 +411,18 @@ class FileSpec(list):
     def getNumberHeaders(self):
         return len(self.headers)
 
+    def getErrorCounts(self):
+        """
+        Returns a dictionary with the number of errors found in the file for each error category.
+        All scans in the file are parsed if needed
+        """
+        counts = {}
+        for block in self.headers + list(self):
+            block._checkAll()
+            for errmsg, count in block._error_counts.items():
+                counts[errmsg] = counts.get(errmsg, 0) + count
+        return counts
+
     def getInfo(self):
         """Returns user and application"""
         ctime = self.getTimeCreated()
@@ -153,12 +434,23 @@ class FileSpec(list):
     def _indexscans(self):
 
         self.fd = open(self.filename, "rb")
-
-        if len(self) > 0:
-            fb = self[-1]
+        try:
+            self._readBlocks()
+        finally:
+            # headers are parsed while indexing and can raise in strict mode
+            self.fd.close()
+
+    def _readBlocks(self):
+
+        # checksum and last non empty line of the current block are kept
+        # in local variables while reading and registered at block end
+        fb = self._lastblock
+        if fb is not None:
             self.fd.seek(self.lastpos)
+            crc = fb.checksum
         else:
-            fb = None
+            crc = 0
+        tailpos, tailline = None, None
 
         line = self.fd.readline()
         lineno = -1
@@ -167,15 +459,20 @@ class FileSpec(list):
             lineno += 1
             sline = line.strip()
 
-            if len(sline) >= 2 and sline[0] == "#" and sline[1] in ['S', 'F', 'E']:
+            if len(sline) >= 2 and sline[0] == "#" and sline[1] in ['S', 'F', 'E'] and \
+                    (sline[1] != 'E' or not self.inheader):
 
                 btype = sline[1]
                 blockstart = self.lastpos
                 blockline = lineno
 
                 if fb:
+                    fb._setExtent(blockstart, crc, tailpos, tailline)
                     fb.end()
 
+                crc = 0
+                tailpos, tailline = None, None
+
                 if btype == 'F':
                     self.origfilename = sline[2:].strip()
                     fb = Header(blockstart, blockline)
@@ -194,18 +491,26 @@ class FileSpec(list):
                         # Assign last added header to current scan
                         fb._setFileHeader(self.headers[-1])
 
+                fb._setSource(self.filename, self.errors)
+
                 if self.origfilename:
                     fb.setFileName(self.origfilename)
 
             if sline and fb:
                 fb.addLine(sline)
+                tailpos, tailline = self.lastpos, sline
+
+            crc = zlib.crc32(line, crc)
 
             self.lastpos = self.fd.tell()
 
             line = self.fd.readline()
 
         # register last block
-        fb.end()
+        if fb:
+            fb._setExtent(self.lastpos, crc, tailpos, tailline)
+            fb.end()
+        self._lastblock = fb
 
         # correct the scan order if necessary
         # assign number in file
@@ -223,7 +528,200 @@ class FileSpec(list):
             scan._setNumberInFile(scanidx)
             scanidx += 1
 
-        self.fd.close()
+
+def parseScanArgs(scanarg):
+    """
+    Parses a scan selection string and returns a list of scans as strings "number[.order]".
+    Scans are separated by "," or spaces and ranges of scan numbers are given as "first:last"
+    (example: "3,6:12 37.1")
+    """
+    args1 = scanarg.split()
+    args = [] 
+    for arg in args1:
+       args.extend( arg.split(",") )
+
+    scanlist = []
+
+    for arg in args:
+      if arg.find(":") != -1:
+         try:
+             arg1, arg2 = arg.split(":")
+             iarg1 = int(arg1)
+             iarg2 = int(arg2)
+         except ValueError:
+             raise ValueError("Bad scan arguments %s" % arg)
+         if iarg2 <= iarg1:
+             raise ValueError("Bad scan arguments %s" % arg)
+         scanlist.extend([ str(val) for val in range(iarg1, iarg2+1) ])
+      elif arg:
+         scanlist.append(arg)
+
+    return scanlist
+
+
+_operators = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+
+def _conditions(where):
+    # a single condition or a list of them
+    if not where:
+        return []
+    if isinstance(where[0], (tuple, list)):
+        return where
+    return [where]
+
+
+class MultiFileSpec(ScanCollection):
+    """
+    Presents the scans in an ordered list of spec files as a single collection, as if they
+    were written in only one file. This is the case for long experiments split in several
+    files after spec restarts.
+
+    Scans keep the number given by spec. Scans with the same number in different files
+    are distinguished by their order in the collection, as for scans in a single file with 
+    several #F sections. Scan objects are the ones of the FileSpec for each file and keep 
+    their order and number in that file: the order and position in the whole collection 
+    are given by getOrder(scan) and getNumberInFile(scan).
+
+    Files are indexed the first time scans are accessed.  
+    """
+
+    def __init__(self, filenames, errors="lenient"):
+
+        self.filenames = list(filenames)
+        self.errors = errors
+
+        self.files = None
+        self.headers = []
+        self.scans = {}
+        self._scanlist = []
+        self._scanfiles = {}
+        self._scanorders = {}
+
+    def _openFile(self, filename):
+        return FileSpec(filename, errors=self.errors)
+
+    def _index(self):
+        if self.files is not None:
+            return
+
+        self.files = [self._openFile(filename) for filename in self.filenames]
+        self._numberScans()
+
+    def _numberScans(self):
+        self.headers = []
+        self.scans = {}
+        self._scanlist = []
+        self._scanfiles = {}
+        self._scanorders = {}
+
+        # order and position in the collection are kept here. scans are
+        # left as numbered by their own FileSpec
+        for fs in self.files:
+            self.headers.extend(fs.headers)
+            for scan in fs:
+                scanno = scan.getNumber()
+                if scanno not in self.scans:
+                    self.scans[scanno] = []
+
+                self.scans[scanno].append(scan)
+                self._scanorders[id(scan)] = (len(self.scans[scanno]) - 1, len(self._scanlist))
+                self._scanlist.append(scan)
+                self._scanfiles[id(scan)] = fs
+
+    def __len__(self):
+        self._index()
+        return len(self._scanlist)
+
+    def __iter__(self):
+        self._index()
+        return iter(self._scanlist)
+
+    def __getitem__(self, idx):
+        self._index()
+        return self._scanlist[idx]
+
+    def addFile(self, filename):
+        """
+        Adds a new file at the end of the collection (for example after a new spec restart)
+        """
+        self.filenames.append(filename)
+        if self.files is not None:
+            self.files.append(self._openFile(filename))
+            self._numberScans()
+
+    def update(self):
+        """
+        Reindexes the last file in the collection if it has grown. Previous files are considered
+        complete and are not checked
+        """
+        if self.files is None:
+            self._index()
+            return True
+
+        modified = self.files and self.files[-1].update()
+        if modified:
+            # update renumbers the scans in the last file
+            self._numberScans()
+        return bool(modified)
+
+    def getFileSpec(self, scan):
+        """
+        Returns the FileSpec object for the file containing `scan`
+        """
+        self._index()
+        return self._scanfiles.get(id(scan))
+
+    def getOrder(self, scan):
+        """
+        Returns the order of `scan` among the scans with the same number in the collection
+        """
+        self._index()
+        return self._scanorders[id(scan)][0]
+
+    def getNumberInFile(self, scan):
+        """
+        Returns the position of `scan` in the whole collection
+        """
+        self._index()
+        return self._scanorders[id(scan)][1]
+
+    def getScanByNumber(self, scanno, scanorder=0):
+        self._index()
+        if scanno in self.scans:
+            if scanorder >= 0 and scanorder < len(self.scans[scanno]):
+                return self.scans[scanno][scanorder]
+        return None
+
+    def getTimeCreated(self):
+        self._index()
+        if self.headers:
+            return self.headers[0].getDate()
+
+    def getUser(self):
+        self._index()
+        if self.headers:
+            return self.headers[0].getUser()
+
+    def getSpec(self):
+        self._index()
+        if self.headers:
+            return self.headers[0].getSpec()
+
+    def getNumberScans(self):
+        self._index()
+        return len(self.scans)
+
+    def getNumberHeaders(self):
+        self._index()
+        return len(self.headers)
 
 
 class FileBlock:
@@ -235,10 +733,18 @@ class FileBlock:
         self.start = start
         self.firstline = firstline
         self.lines = []
+
+        # extent of the block in file and checksums used to verify it
+        self.stop = start
+        self.checksum = 0
+        self._tailpos = start
+        self._tailcrc = 0
         self._filename = None
         self._contains_error = False
         self._error_messages = []
         self._id = ""
+        self._path = None
+        self._errpolicy = "lenient"
 
         self.funcs = {
             'S': self.addSLine,
@@ -287,11 +793,13 @@ class FileBlock:
         self._geo_pars = []
         self._qvalue = 0
         self._extra_lines = []
-        self._wrong_lines = []
         self._error_messages = []
+        self._error_counts = {}
+        self._error_samples = []
         self._contains_error = False
         self._find_oned = True
         self.reading_mca = False
+        self._statistics = None
 
     def addLine(self, line):
         self.lines.append(line)
@@ -301,6 +809,9 @@ class FileBlock:
 
     def parse(self):
 
+        # blocks can be parsed more than once (headers, for example)
+        self.resetParsedData()
+
         lineno = -1
         oned_idx = 0
         data_line = 0
@@ -311,19 +822,7 @@ class FileBlock:
                 continue
 
             if len(sline) > 1 and sline[0] == "#":
-                widx = sline.find(" ")
-                if widx < 2:
-                    continue
-
-                metakey = sline[1]
-                metaval = sline[2:widx].strip()
-                content = sline[widx:].strip()
-
-                if metakey in self.funcs:
-                    self.funcs[metakey](content.strip(), metaval)
-                else:
-                    self.wrongLine(
-                        lineno, sline, "unknown header line (%s) " % metakey)
+                self._parseHeaderLine(lineno, sline)
             else:
                 data_line += 1
                 if sline[0:2] == '@A':
@@ -340,7 +839,8 @@ class FileBlock:
                                 break
                         else:
                             self._oned_dets[oned_idx].name = 'OneDDet_%d' % oned_idx
-                    self.tmpmca = McaData()
+                        self._oned_dets[oned_idx].channels = self._getMcaChannels(oned_idx)
+                    self.tmpmca = McaData(self, lineno)
 
                 if self.reading_mca:
                     complete = self.tmpmca._addLine(sline)
@@ -351,36 +851,198 @@ class FileBlock:
                 else:
                     oned_idx = 0
                     try:
-                        try:
-                            dataline = list(map(float, sline.strip().split()))
-                        except:
-                            self.wrongLine(lineno, sline, "wrong data line")
-                            continue
-
-                        if len(dataline) != self._columns:
-                            self.wrongLine(
-                                lineno, sline, "wrong number of columns")
-                        else:
-                            self._data.append(dataline)
-                            if len(self._data) == comp_line:
-                                self._find_oned = False
+                        dataline = list(map(float, sline.split()))
                     except ValueError:
-                        self.wrongLine(lineno, sline, "cannot parse line ")
+                        self.wrongLine(lineno, sline, "wrong data line")
+                        continue
+
+                    if len(dataline) != self._columns:
+                        self.wrongLine(
+                            lineno, sline, "wrong number of columns")
+                    else:
+                        self._data.append(dataline)
+                        if len(self._data) == comp_line:
+                            self._find_oned = False
 
 
         self.is_parsed = True
+        self._shareNames()
         self.finalizeParsing()
 
+    def _parseHeaderLine(self, lineno, sline):
+        widx = sline.find(" ")
+        if widx < 2:
+            return
+
+        metakey = sline[1]
+        metaval = sline[2:widx].strip()
+        content = sline[widx:].strip()
+
+        if metakey in self.funcs:
+            self.funcs[metakey](content, metaval)
+        else:
+            self.wrongLine(
+                lineno, sline, "unknown header line (%s)" % metakey)
+
+    def _parseHeader(self):
+        # parses only header lines in block. data lines are left for a full parse()
+        self.resetParsedData()
+        lineno = -1
+        for sline in self.lines:
+            lineno += 1
+            if len(sline) > 1 and sline[0] == "#":
+                self._parseHeaderLine(lineno, sline)
+
+    def _shareNames(self):
+        # motor and counter names are the same for many blocks. only one
+        # copy of each list of names is kept
+        self._motor_labels = _sharedNames(self._motor_labels)
+        self._motor_mnes = _sharedNames(self._motor_mnes)
+        self._counter_labels = _sharedNames(self._counter_labels)
+        self._counter_mnes = _sharedNames(self._counter_mnes)
+
     def finalizeParsing(self):
         pass
 
+    def _getMcaChannels(self, det_no):
+        # number of channels for a 1D detector as given by #@CHANN lines.
+        # a single #@CHANN line applies to all detectors
+        chann = [content for keyval, content in self._extra_lines if keyval == 'CHANN']
+        if not chann:
+            return None
+        if det_no >= len(chann):
+            det_no = 0
+        try:
+            return int(chann[det_no].split()[0])
+        except (ValueError, IndexError):
+            return None
+
     def wrongLine(self, lineno, sline, errmsg):
-        self._wrong_lines.append([errmsg, sline])
+        if self._errpolicy == "strict":
+            raise FileSpecError("erroneous data / %s in line %s of block %s" % (errmsg, lineno + 1, self._id))
+
+        self._error_counts[errmsg] = self._error_counts.get(errmsg, 0) + 1
+        self._contains_error = True
+
+        if self._errpolicy == "skip" or len(self._error_samples) >= MAX_ERROR_SAMPLES:
+            return
+
+        self._error_samples.append((errmsg, lineno))
         line = "%s (%s)" % (lineno + 1, self.firstline + lineno + 1)
         ermsg = "erroneous data / %s " % errmsg
         self._error_messages.append([self._id, line, ermsg])
+
+    def blockError(self, errmsg):
+        """
+        Registers an error affecting the whole block rather than a single line
+        """
+        if self._errpolicy == "strict":
+            # block errors are found after parsing lines. as for wrong lines,
+            # the block must raise again if accessed later
+            self.is_parsed = False
+            raise FileSpecError("%s in block %s" % (errmsg, self._id))
+
+        self._error_counts[errmsg] = self._error_counts.get(errmsg, 0) + 1
         self._contains_error = True
 
+        if self._errpolicy == "skip":
+            return
+
+        self._error_messages.append([self._id, "", errmsg])
+
+    def getErrors(self):
+        """
+        Returns a dictionary describing the errors found while parsing the block:
+          'total'   - total number of errors
+          'counts'  - number of errors for each error category
+          'samples' - list of (category, byte offset in file) for the first erroneous lines
+        Only error counts are kept when the error policy is "skip". MCA spectra not yet decoded 
+        are checked for wrong values
+        """
+        self._checkAll()
+
+        offsets = self._lineOffsets([lineno for errmsg, lineno in self._error_samples])
+        samples = [(errmsg, offsets.get(lineno)) for errmsg, lineno in self._error_samples]
+
+        return {
+            'total': sum(self._error_counts.values()),
+            'counts': dict(self._error_counts),
+            'samples': samples,
+        }
+
+    def _checkAll(self):
+        # parses the block and checks the values in mca spectra, that are
+        # otherwise only checked when decoded
+        if not self.is_parsed:
+            self.parse()
+
+        for oned in self._oned_dets:
+            for mcadata in oned:
+                mcadata._check()
+
+    def _lineOffsets(self, linenos):
+        # byte offsets in file for lines in block. offsets are not kept while indexing, 
+        # so they are searched in the file for the (few) lines that need them
+        offsets = {}
+        if not linenos or not self._path:
+            return offsets
+
+        wanted = set(linenos)
+        lastline = max(linenos)
+
+        fd = open(self._path, "rb")
+        try:
+            fd.seek(self.start)
+            pos = self.start
+            lineno = -1
+            while lineno < lastline:
+                line = fd.readline()
+                if not line:
+                    break
+                # empty lines are not added to the block
+                if line.strip():
+                    lineno += 1
+                    if lineno in wanted:
+                        offsets[lineno] = pos
+                pos += len(line)
+        finally:
+            fd.close()
+
+        return offsets
+
+    def _setSource(self, path, errpolicy):
+        self._path = path
+        self._errpolicy = errpolicy
+
+    def _setExtent(self, stop, checksum, tailpos, tailline):
+        self.stop = stop
+        self.checksum = checksum
+        if tailpos is not None:
+            self._tailpos = tailpos
+            self._tailcrc = zlib.crc32(tailline)
+
+    def _verify(self, fd, full=False):
+        # checks that block content in file (opened as fd) is the one indexed
+        if full:
+            fd.seek(self.start)
+            crc = 0
+            remaining = self.stop - self.start
+            while remaining > 0:
+                chunk = fd.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    return False
+                crc = zlib.crc32(chunk, crc)
+                remaining -= len(chunk)
+            return crc == self.checksum
+
+        if self.lines:
+            fd.seek(self.start)
+            if fd.readline().strip() != self.lines[0]:
+                return False
+
+        fd.seek(self._tailpos)
+        return zlib.crc32(fd.readline().strip()) == self._tailcrc
+
     def setFileName(self, filename):
         self._filename = filename
 
@@ -420,7 +1082,7 @@ class FileBlock:
         self._motor_labels.extend(re.split("\s\s+", content))
 
     def addMotorMneLine(self, content, keyval=None):
-        self._motor_mnes.extend(re.split("\s", content))
+        self._motor_mnes.extend(content.split())
 
     def addCounterLabelLine(self, content, keyval=None):
         # Beware of double spacing
@@ -428,10 +1090,10 @@ class FileBlock:
 
     def addCounterMneLine(self, content, keyval=None):
         # Beware of double spacing
-        self._counter_mnes.extend(re.split("\s", content))
+        self._counter_mnes.extend(content.split())
 
     def addMotorPositionLine(self, content, keyval=None):
-        self._motor_positions.extend(content.split(" "))
+        self._motor_positions.extend(content.split())
 
     def addUserLine(self, content, keyval=None):
         self._user_lines.append(content)
@@ -518,6 +1180,12 @@ class Scan(FileBlock):
         self._numberinfile = -1
         self._order = 1
 
+        # decimation results and the column values they are computed from are
+        # kept across updates of the scan so that they can be extended
+        # incrementally when new points are appended
+        self._decimated = OrderedDict()
+        self._decimated_values = OrderedDict()
+
     def end(self):
         self.resetParsedData()
 
@@ -525,24 +1193,20 @@ class Scan(FileBlock):
 
         # prepare motor positions
         labels = self.getMotorNames()
-        poss = self._motor_positions
+        poss = self._motor_positions = _parsePositions(self._motor_positions)
         poserr = False
         self.motor_positions_list = None
 
         if not labels:
-            ermsg = "no motor names"
-            self._error_messages.append([self._id, "", ermsg])
-            self._contains_error = True
+            self.blockError("no motor names")
             poserr = True
 
         elif len(labels) != len(poss):
-            ermsg = "number of motor labels and positions are different"
-            self._error_messages.append([self._id, "", ermsg])
-            self._contains_error = True
+            self.blockError("number of motor labels and positions are different")
             poserr = True
 
         if not poserr:
-            self.motor_positions_list = list(zip(labels, poss))
+            self.motor_positions_list = MotorPositions(labels, poss)
 
     def _setFileHeader(self, header):
         self._fileheader = header
@@ -564,7 +1228,21 @@ class Scan(FileBlock):
         to the scan at the time it was executed.  
         """
         if not self.is_parsed:
-            self.parse()
+            return self._peekNumber()
+        return self._number
+
+    def _peekNumber(self):
+        # the scan number is in the first line of the block (#S line). reading it 
+        # there avoids parsing the whole scan when only indexing or listing files
+        if self.lines:
+            parts = self.lines[0].split(None, 2)
+            if len(parts) > 1 and parts[0] == "#S":
+                try:
+                    return int(parts[1])
+                except ValueError:
+                    pass
+
+        self.parse()
         return self._number
 
     def getOrder(self):
@@ -585,6 +1263,8 @@ class Scan(FileBlock):
         """
         Returns number of data lines
         """
+        if not self.is_parsed:
+            self.parse()
         return len(self._data)
 
     def getColumns(self):
@@ -603,6 +1283,18 @@ class Scan(FileBlock):
             self.parse()
         return self._labels
 
+    def _columnIndex(self, column):
+        # column can be given by label or index. None if not in scan
+        if isinstance(column, int):
+            if -self._columns <= column < self._columns:
+                return column
+            return None
+
+        labels = self._labels or []
+        if column in labels:
+            return labels.index(column)
+        return None
+
     def getCommand(self):
         """
         Returns a string containing the command that was run in spec to start the scan
@@ -669,7 +1361,8 @@ class Scan(FileBlock):
 
     def getMotorPositions(self):
         """
-        Returns a dictionary with motor names and positions. These are the positions of the motors when the scan was started
+        Returns a MotorPositions object with motor names and positions. These are the positions of the motors when the scan was started.
+        Positions can be accessed by motor name as in a dictionary. Iterating on it gives (name, position) pairs
         """
         if not self.is_parsed:
             self.parse()
@@ -798,7 +1491,10 @@ class Scan(FileBlock):
         meta["HKL"] = self.getHKL()
         meta["date"] = self.getDate()
         meta["scanno"] = self.getNumber()
-        meta["motors"] = self.getMotorPositions()
+        # plain list of (name, position) pairs, so that metadata can be serialized
+        positions = self.getMotorPositions()
+        if positions is not None:
+            meta["motors"] = list(positions)
         meta["motnames"] = self.getMotorNames()
         meta["comments"] = self.getComments()
         meta["order"] = self.getOrder()
@@ -818,17 +1514,311 @@ class Scan(FileBlock):
 
         return meta
 
-    def getData(self):
+    def getData(self, decimate=None, dtype=None, structured=False):
         """ 
         Returns a numpy array with all data in the scan
+
+        If `decimate` is given, at most about `decimate` rows are returned, selected with
+        min-max bucketing on the last column (see getDecimatedData)
+
+        `dtype` selects the type of the values (float64 by default). float32 can be used 
+        to halve the memory used by large scans.
+
+        If `structured` is True, a structured array with one field per column label is returned.
+        It is a view on the same memory, so columns can be accessed by name (data["Detector"]) 
+        without copies. Use data.view(numpy.recarray) for attribute access to columns
         """
         if not self.is_parsed:
             self.parse()
 
-        if self._data:
-            return numpy.array(self._data, dtype=numpy.float)
+        _importNumpy()
+
+        if dtype is None:
+            dtype = numpy.float64
+
+        if decimate:
+            data = self.getDecimatedData(decimate).astype(dtype, copy=False)
+        elif self._data:
+            data = numpy.array(self._data, dtype=dtype)
+        else:
+            data = numpy.empty((0, self._columns), dtype=dtype)
+
+        if structured:
+            data = self._structuredView(data)
+
+        return data
+
+    def getFilteredData(self, columns=None, where=None, dtype=None):
+        """
+        Returns a 2D numpy array with the values of `columns` (labels or column indices, all 
+        columns by default) for the data points matching the conditions in `where`.
+
+        A condition is a tuple (column, operator, value), with operator one out of 
+        "<", "<=", ">", ">=", "==" or "!=".  `where` can be a single condition or a list of 
+        conditions that must all be true. Example:  
+
+            scan.getFilteredData(["Theta", "Detector"], where=("Detector", ">", 1000))
+
+        If the scan has not been parsed, data lines are read directly and only selected points and
+        columns are kept, without building the full data array. Data lines are checked as in 
+        parse(): lines with a wrong number of values or with values that are not numbers are 
+        skipped, so the result is the same whether the scan has been parsed or not
+        """
+        if not self.is_parsed:
+            self._parseHeader()
+
+        if isinstance(columns, _string_types):
+            columns = [columns]
+
+        if columns is not None:
+            for column in columns:
+                if self._columnIndex(column) is None:
+                    raise ValueError("no column %s in scan %s" % (column, self._number))
+
+        return self._filteredData(columns, where, dtype)
+
+    def _filteredData(self, columns, where, dtype=None):
+        # as getFilteredData. columns not in scan are filled with NaN and
+        # conditions on columns not in scan match no points
+        _importNumpy()
+
+        if not self.is_parsed:
+            self._parseHeader()
+
+        if columns is None:
+            columns = list(range(self._columns))
+        if dtype is None:
+            dtype = numpy.float64
+
+        project = [self._columnIndex(column) for column in columns]
+
+        conditions = []
+        for column, opname, value in _conditions(where):
+            if opname not in _operators:
+                raise ValueError("wrong operator %s in condition" % opname)
+            colidx = self._columnIndex(column)
+            if colidx is None:
+                return numpy.empty((0, len(project)), dtype=dtype)
+            conditions.append((colidx, _operators[opname], float(value)))
+
+        if self.is_parsed:
+            # only the columns used are converted
+            used = set([colidx for colidx in project if colidx is not None])
+            used.update([colidx for colidx, op, value in conditions])
+            coldata = {}
+            for colidx in used:
+                coldata[colidx] = numpy.array([row[colidx] for row in self._data], dtype=numpy.float64)
+
+            mask = numpy.ones(len(self._data), dtype=bool)
+            for colidx, op, value in conditions:
+                mask &= op(coldata[colidx], value)
+
+            result = numpy.empty((int(mask.sum()), len(project)), dtype=dtype)
+            for colno, colidx in enumerate(project):
+                if colidx is None:
+                    result[:, colno] = numpy.nan
+                else:
+                    result[:, colno] = coldata[colidx][mask]
+            return result
+
+        nan = float("nan")
+        ncols = self._columns
+        rows = []
+        inmca = False
+
+        for sline in self.lines:
+            if sline[0] == "#":
+                continue
+
+            # skip mca lines with their continuation lines
+            if inmca or sline[:2] == "@A":
+                inmca = sline[-1] == "\\"
+                continue
+
+            try:
+                values = list(map(float, sline.split()))
+            except ValueError:
+                continue
+
+            if len(values) != ncols:
+                continue
+
+            for colidx, op, value in conditions:
+                if not op(values[colidx], value):
+                    break
+            else:
+                rows.append([values[colidx] if colidx is not None else nan
+                             for colidx in project])
+
+        return numpy.array(rows, dtype=dtype).reshape(len(rows), len(project))
+
+    def getFieldNames(self):
+        """
+        Returns the names of the fields for the structured arrays returned by getData. 
+        These are the column labels, made unique if needed
+        """
+        if not self.is_parsed:
+            self.parse()
+
+        labels = list(self._labels or [])[:self._columns]
+        labels += ["col%d" % colno for colno in range(len(labels), self._columns)]
+
+        names = []
+        for label in labels:
+            name = label
+            dupno = 0
+            while name in names:
+                dupno += 1
+                name = "%s_%d" % (label, dupno)
+            names.append(name)
+        return names
+
+    def _structuredView(self, data):
+        data = numpy.ascontiguousarray(data)
+        names = self.getFieldNames()
+        if data.shape[1] != len(names):
+            raise ValueError("cannot name %d data columns with %d labels" % (data.shape[1], len(names)))
+
+        fields = numpy.dtype([(str(name), data.dtype) for name in names])
+        return data.view(fields).reshape(data.shape[0])
+
+    def getDecimatedData(self, points, column=-1):
+        """
+        Returns a reduced version of the scan data meant for plotting, with about `points` rows.
+
+        Data rows are grouped in buckets and, for each bucket, the rows with minimum and maximum
+        value in `column` (by default the last one) are kept, so that peaks and dips survive the
+        reduction. First and last rows are always included.  Bucket sizes are powers of two so
+        that results can be reused and extended incrementally as new points arrive in the scan:
+        only the values in `column` for the new points are converted and reduced, and only the
+        selected rows are converted for the result. Data lines are still parsed again after
+        the scan is updated
+        """
+        if not self.is_parsed:
+            self.parse()
+
+        _importNumpy()
+
+        nrows = len(self._data)
+
+        if nrows <= points:
+            return self.getData()
+
+        if column < 0:
+            column += self._columns
+        values = self._columnValues(column)
+
+        nbuckets = max((points - 2) // 2, 1)
+        bucket = 1
+        while bucket * nbuckets < nrows:
+            bucket *= 2
+
+        # indices of complete buckets are cached, the last partial bucket is
+        # always recalculated
+        key = (points, column)
+        complete = (nrows // bucket) * bucket
+        cached = self._decimated.get(key)
+
+        if cached is None or cached[1] > nrows:
+            indices = _minmaxBuckets(values, 0, complete, bucket)
         else:
-            return numpy.empty((0, self._columns))
+            oldbucket, oldcomplete, indices = cached
+            if oldbucket != bucket:
+                # bucket size grew. previous candidates still contain the
+                # extreme values for the new (larger) buckets
+                oldcomplete = (oldcomplete // bucket) * bucket
+                indices = _mergeBuckets(values, indices[indices < oldcomplete], bucket)
+            indices = numpy.concatenate(
+                (indices, _minmaxBuckets(values, oldcomplete, complete, bucket)))
+
+        _cacheDecimated(self._decimated, key, (bucket, complete, indices))
+
+        tail = numpy.arange(complete, nrows)
+        if len(tail):
+            tail = numpy.array([tail[values[complete:].argmin()], tail[values[complete:].argmax()]])
+
+        rows = numpy.unique(numpy.concatenate(([0], indices, tail, [nrows - 1])).astype(int))
+        return numpy.array([self._data[row] for row in rows], dtype=numpy.float64)
+
+    def _columnValues(self, column):
+        # values in one data column, converted only for the points added since last call
+        nrows = len(self._data)
+        values = self._decimated_values.get(column)
+
+        if values is None or len(values) > nrows:
+            values = numpy.empty(0, dtype=numpy.float64)
+
+        if len(values) < nrows:
+            newvals = numpy.array([row[column] for row in self._data[len(values):]], dtype=numpy.float64)
+            values = numpy.concatenate((values, newvals))
+        _cacheDecimated(self._decimated_values, column, values)
+
+        return values
+
+    def getStatistics(self):
+        """
+        Returns a dictionary with summary statistics for each data column, keyed by the unique
+        column names given by getFieldNames (duplicated labels get a "_1", "_2"... suffix).
+        For every column a dictionary with 'min', 'max', 'sum', 'mean', 'argmax' and 'nan' (number
+        of NaN values) is given. NaN values are ignored in the other statistics.
+
+        Statistics are computed from the parsed data on the first call, at about the cost of
+        getData(), and cached until the scan is parsed again. Only repeated calls are cheap.
+        SharedScanCache.getStatistics (specpython.sharedcache) keeps them across parses, file
+        updates and processes, for overview pages over many scans
+        """
+        if not self.is_parsed:
+            self.parse()
+
+        if self._statistics is None:
+            _importNumpy()
+            self._statistics = self._computeStatistics()
+        return self._statistics
+
+    def _computeStatistics(self):
+        names = self.getFieldNames()
+        stats = {}
+
+        if not self._data:
+            return stats
+
+        data = numpy.array(self._data, dtype=numpy.float64)
+        nans = numpy.isnan(data)
+        nancount = nans.sum(axis=0)
+        valid = data.shape[0] - nancount
+
+        # NaN values are replaced so that plain reductions can be used on all columns at once
+        lowest = numpy.where(nans, numpy.inf, data)
+        highest = numpy.where(nans, -numpy.inf, data)
+        sums = numpy.where(nans, 0.0, data).sum(axis=0)
+        mins = lowest.min(axis=0)
+        maxs = highest.max(axis=0)
+        argmaxs = highest.argmax(axis=0)
+
+        for colno in range(data.shape[1]):
+            if colno < len(names):
+                name = names[colno]
+            else:
+                name = "col%d" % colno
+
+            if valid[colno]:
+                colstats = {
+                    'min': float(mins[colno]),
+                    'max': float(maxs[colno]),
+                    'sum': float(sums[colno]),
+                    'mean': float(sums[colno] / valid[colno]),
+                    'argmax': int(argmaxs[colno]),
+                    'nan': int(nancount[colno]),
+                }
+            else:
+                colstats = {
+                    'min': None, 'max': None, 'sum': 0.0,
+                    'mean': None, 'argmax': None,
+                    'nan': int(nancount[colno]),
+                }
+            stats[name] = colstats
+
+        return stats
 
     def getNumberMcas(self):
         """ 
@@ -862,6 +1852,21 @@ class Scan(FileBlock):
             self.parse()
         return self._oned_dets[det_no][point_no]
 
+    def getMcaMismatches(self):
+        """
+        Returns a dictionary with the spectra with a wrong number of channels, keyed by 1D detector
+        name. For each detector a list of (point number, number of channels) is given
+        """
+        if not self.is_parsed:
+            self.parse()
+
+        mismatches = {}
+        for oned in self._oned_dets:
+            detmism = oned.getMismatches()
+            if detmism:
+                mismatches[oned.name] = detmism
+        return mismatches
+
     def getOneDDetector(self, det_no):
         if not self.is_parsed:
             self.parse()
@@ -920,13 +1925,133 @@ format readable by excel and other programs
         ofd.write("\n")
 
 
+def _parsePositions(values):
+    try:
+        return array('d', map(float, values))
+    except ValueError:
+        positions = array('d')
+        for value in values:
+            try:
+                positions.append(float(value))
+            except ValueError:
+                positions.append(float('nan'))
+        return positions
+
+
+class MotorPositions:
+    """
+    The class MotorPositions holds the motor positions for a scan.  
+
+    Positions are kept in a compact array of floats aligned with the tuple of motor names, 
+    which is shared by all scans using the same motors. 
+
+    It can be used as a read-only dictionary (positions["Theta"], keys(), items(), get()...). 
+    Iterating on it or indexing it with an integer gives (name, position) pairs, as the list 
+    of pairs returned by previous versions of getMotorPositions
+    """
+
+    def __init__(self, names, positions):
+        self.names = names
+        self.positions = positions
+        self._index = _nameIndex(names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(zip(self.names, self.positions))
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return (self.names[key], self.positions[key])
+        return self.positions[self._index[key]]
+
+    def __eq__(self, other):
+        if not isinstance(other, (MotorPositions, list, tuple)):
+            return NotImplemented
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    def __repr__(self):
+        return "MotorPositions(%s)" % list(self)
+
+    def get(self, name, default=None):
+        idx = self._index.get(name)
+        if idx is None:
+            return default
+        return self.positions[idx]
+
+    def keys(self):
+        return self.names
+
+    def values(self):
+        return self.positions
+
+    def items(self):
+        return list(self)
+
+
+def _cacheDecimated(cache, key, value):
+    """ stores value in one of the (bounded) decimation caches of a scan """
+    cache.pop(key, None)
+    cache[key] = value
+    while len(cache) > DECIMATION_CACHE_SIZE:
+        cache.popitem(last=False)
+
+
+def _minmaxBuckets(values, start, stop, bucket):
+    """ indices of minimum and maximum values for each bucket in values[start:stop] """
+    if stop <= start:
+        return numpy.empty(0, dtype=int)
+
+    block = values[start:stop].reshape(-1, bucket)
+    offsets = numpy.arange(start, stop, bucket)
+    mins = block.argmin(axis=1) + offsets
+    maxs = block.argmax(axis=1) + offsets
+    return numpy.unique(numpy.concatenate((mins, maxs)))
+
+
+def _mergeBuckets(values, indices, bucket):
+    """ reduces candidate indices to the minimum and maximum for each (larger) bucket """
+    if not len(indices):
+        return indices
+
+    groups = indices // bucket
+    splits = numpy.flatnonzero(numpy.diff(groups)) + 1
+
+    merged = []
+    for group in numpy.split(indices, splits):
+        groupvals = values[group]
+        merged.append(group[groupvals.argmin()])
+        merged.append(group[groupvals.argmax()])
+    return numpy.unique(merged)
+
+
 class McaData:
     """ 
     The class MCA data represents 1D data
+
+    Lines for a spectrum are kept as text until the data is requested. All the continuation
+    lines of the spectrum are then decoded at once into a numpy array.  Values that are not
+    numbers are reported as wrong lines of the block containing the spectrum (following its 
+    error policy) when the spectrum is decoded, and replaced by NaN
     """
 
-    def __init__(self):
-        self.data = []
+    def __init__(self, block=None, lineno=None):
+        self._chunks = []
+        self._values = None
+        self._list = None
+        self._block = block
+        self._lineno = lineno
+        self._checked = False
         self.calib = None
 
     def getCalib(self):
@@ -935,23 +2060,85 @@ class McaData:
     def setCalib(self, calib):
         self.calib = calib
 
+    @property
+    def data(self):
+        """ 
+        List with the values for all channels, as in previous versions. It is built once, on
+        first access. From then on the list is where the values are kept: changes made to it 
+        are seen by getValues() and getData(), which convert it again on each call
+        """
+        if self._list is None:
+            self._list = self.getValues().tolist()
+            self._values = None
+        return self._list
+
+    def getValues(self):
+        """
+        Returns a 1D numpy array with the values for all channels in the spectrum
+        """
+        if self._list is not None:
+            _importNumpy()
+            return numpy.array(self._list, dtype=numpy.float64)
+
+        if self._values is None:
+            self._values = self._decode()
+            self._chunks = []
+        return self._values
+
+    def _check(self):
+        # reports wrong values without keeping the decoded spectrum
+        if not self._checked and self._values is None and self._list is None:
+            self._decode()
+
+    def _decode(self):
+        _importNumpy()
+        text = " ".join(self._chunks)
+        try:
+            values = decodeMca(text)
+        except ValueError:
+            if not self._checked and self._block is not None:
+                self._block.wrongLine(self._lineno, "@A " + text, "wrong mca data")
+            values = numpy.array([_floatOrNan(value) for value in text.split()], dtype=numpy.float64)
+        self._checked = True
+        return values
+
     def getData(self):
-        channels = list(range(len(self.data)))
-        if self.data:
-            return numpy.array([channels, self.data], dtype=numpy.float).transpose()
+        _importNumpy()
+        values = self.getValues()
+        if len(values):
+            channels = numpy.arange(len(values), dtype=numpy.float64)
+            return numpy.array([channels, values]).transpose()
         else:
             return numpy.empty((0, 1))
 
     def _addLine(self, line):
-        if line.strip()[-1] == "\\":
-            dataline = line.strip()[:-1]
-            complete = False
-        else:
-            dataline = line
-            complete = True
+        # lines come already stripped from the file block
+        if line[-1:] == "\\":
+            self._chunks.append(line[:-1])
+            return False
+
+        self._chunks.append(line)
+        return True
+
+
+def decodeMca(text):
+    """
+    Decodes the text for a full spectrum (channel values separated by white space) into 
+    a 1D numpy array in a single call. Raises ValueError if any of the values is not a number
+    """
+    _importNumpy()
+    values = numpy.fromstring(text, dtype=numpy.float64, sep=" ")
+    # fromstring stops at the first value that is not a number
+    if len(values) != len(text.split()):
+        raise ValueError("wrong value in mca data")
+    return values
+
 
-        self.data.extend(list(map(float, dataline.split())))
-        return complete
+def _floatOrNan(value):
+    try:
+        return float(value)
+    except ValueError:
+        return float("nan")
 
 
 class OneDDetector(list):
@@ -962,12 +2149,44 @@ class OneDDetector(list):
     def __init__(self):
         list.__init__(self)
         self.name = ''
+        self.channels = None
+        self._mismatches = None
 
     def getData(self):
-        data = []
-        for mcadata in self:
-            raw_data = mcadata.getData().transpose()[1].tolist()
-            data.append(raw_data)
-        return numpy.array(data, dtype=numpy.float)
+        """
+        Returns a 2D numpy array with one spectrum per row. 
+
+        The number of columns is the number of channels declared in the file (#@CHANN) or, 
+        if not declared, the one of the first spectrum. Spectra with a different number of channels
+        are truncated or padded with NaN values and reported by getMismatches()
+        """
+        _importNumpy()
+        spectra = [mcadata.getValues() for mcadata in self]
 
+        nchan = self.channels
+        if nchan is None:
+            nchan = spectra and len(spectra[0]) or 0
 
+        data = numpy.empty((len(spectra), nchan), dtype=numpy.float64)
+        self._mismatches = []
+
+        for pointno, values in enumerate(spectra):
+            nvals = len(values)
+            if nvals == nchan:
+                data[pointno] = values
+            else:
+                self._mismatches.append((pointno, nvals))
+                nvals = min(nvals, nchan)
+                data[pointno, :nvals] = values[:nvals]
+                data[pointno, nvals:] = numpy.nan
+
+        return data
+
+    def getMismatches(self):
+        """
+        Returns a list of (point number, number of channels) for the spectra whose number of
+        channels does not match the one expected for the detector
+        """
+        if self._mismatches is None:
+            self.getData()
+        return self._mismatches
@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+#******************************************************************************
+#
+#  %W%  %G% CSS
+#
+#  "splot" Release %R%
+#
+#  Copyright (c) 2013,2014,2015,2016
+#  by Certified Scientific Software.
+#  All rights reserved.
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a
+#  copy of this software ("splot") and associated documentation files (the
+#  "Software"), to deal in the Software without restriction, including
+#  without limitation the rights to use, copy, modify, merge, publish,
+#  distribute, sublicense, and/or sell copies of the Software, and to
+#  permit persons to whom the Software is furnished to do so, subject to
+#  the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  Neither the name of the copyright holder nor the names of its contributors
+#  may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#     * The software is provided "as is", without warranty of any   *
+#     * kind, express or implied, including but not limited to the  *
+#     * warranties of merchantability, fitness for a particular     *
+#     * purpose and noninfringement.  In no event shall the authors *
+#     * or copyright holders be liable for any claim, damages or    *
+#     * other liability, whether in an action of contract, tort     *
+#     * or otherwise, arising from, out of or in connection with    *
+#     * the software or the use of other dealings in the software.  *
+#
+#******************************************************************************
+
+"""
+
+****************
+sharedcache
+****************
+
+Description
+****************
+   Cache for parsed scan data shared between processes.
+
+   Arrays obtained from scans (data, 1D detector blocks and column
+   statistics) are saved as numpy files in a memory backed directory
+   (/dev/shm/specpython-<uid> by default, private to each user). Every
+   process reading the same scan maps the same file, so the data is parsed
+   only once and no copy is made in the processes using it. The cache
+   directory must be owned by the user running the process.
+
+   Entries are identified by file identity (device and inode) and by the
+   extent of the scan in the file (offset, end and checksum of its content),
+   so that data appended to a file only invalidates the scan still growing
+   and scans from a file that has been rewritten or replaced are never
+   confused with older ones. Entries for previous extents of a scan are
+   removed when the new one is stored.
+
+   Reference counting for the entries is left to the operating system: an
+   evicted file remains valid for the processes that have it mapped and
+   its memory is released when the last of them drops its view.
+
+Example
+****************
+   from specpython.filespec import FileSpec
+   from specpython.sharedcache import SharedScanCache
+
+   cache = SharedScanCache(maxsize=2 * 1024**3)
+   fs = FileSpec("data/acq.dat")
+   data = cache.getData(fs, fs[2])   # read-only view on shared memory
+
+"""
+
+import os
+import stat
+import tempfile
+
+import numpy
+
+# the default directory is private to each user. it is in a world writable
+# directory, so it is created with restricted permissions and only used if
+# owned by the current user (see SharedScanCache)
+if hasattr(os, "getuid"):
+    _dirname = "specpython-%d" % os.getuid()
+else:
+    _dirname = "specpython"
+
+if os.path.isdir("/dev/shm"):
+    DEFAULT_DIRECTORY = os.path.join("/dev/shm", _dirname)
+else:
+    DEFAULT_DIRECTORY = os.path.join(tempfile.gettempdir(), _dirname)
+
+DEFAULT_MAXSIZE = 1024 * 1024 * 1024
+
+
+class SharedScanCache:
+    """
+    Cross-process cache of scan arrays backed by memory mapped files
+    """
+
+    suffix = ".npy"
+
+    def __init__(self, directory=None, maxsize=DEFAULT_MAXSIZE):
+
+        if directory is None:
+            directory = DEFAULT_DIRECTORY
+
+        self.directory = directory
+        self.maxsize = maxsize
+
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory, 0o700)
+            except OSError:
+                # created meanwhile by another process
+                if not os.path.isdir(self.directory):
+                    raise
+
+        self._checkOwner(directory == DEFAULT_DIRECTORY)
+
+    def _checkOwner(self, nolink):
+        # entries in a directory owned by another user could be planted there
+        if not hasattr(os, "getuid"):
+            return
+
+        if nolink:
+            dirstat = os.lstat(self.directory)
+        else:
+            dirstat = os.stat(self.directory)
+
+        if not stat.S_ISDIR(dirstat.st_mode) or dirstat.st_uid != os.getuid():
+            raise OSError("cache directory %s is not a directory owned by the current user" % self.directory)
+
+    def getData(self, filespec, scan):
+        """
+        Returns a read-only numpy array with all data in the scan
+        """
+        return self._get(filespec, scan, "data", scan.getData)
+
+    def getMcas(self, filespec, scan, det_no=0):
+        """
+        Returns a read-only 2D numpy array with all the spectra of one 1D detector in the scan
+        """
+        # the scan is only parsed if the entry is not in the cache
+        producer = lambda: scan.getOneDDetector(det_no).getData()
+        return self._get(filespec, scan, "mca%d" % det_no, producer)
+
+    def getStatistics(self, filespec, scan):
+        """
+        Returns the summary statistics for the data columns of the scan, as Scan.getStatistics().
+        The scan is only parsed the first time. Statistics are kept while the scan is unchanged,
+        even if the file grows or the scan is parsed again, so overview pages over many scans 
+        do not need to build their data arrays
+        """
+        producer = lambda: _statisticsArray(scan.getStatistics())
+        return _statisticsDict(self._get(filespec, scan, "stats", producer))
+
+    def getSize(self):
+        """
+        Returns the number of bytes used by the cache entries
+        """
+        return sum([size for size, mtime, path in self._entries()])
+
+    def clear(self, filespec=None):
+        """
+        Removes all the entries in the cache, or only the ones for `filespec` if given
+        """
+        if filespec is not None:
+            prefix = self._fileid(filespec) + "-"
+        else:
+            prefix = ""
+
+        for size, mtime, path in self._entries():
+            if os.path.basename(path).startswith(prefix):
+                self._remove(path)
+
+    def _fileid(self, filespec):
+        stat = filespec.filestat
+        return "%x-%x" % (stat.st_dev, stat.st_ino)
+
+    def _scanid(self, filespec, scan):
+        return "%s-%x" % (self._fileid(filespec), scan.start)
+
+    def _key(self, filespec, scan, kind):
+        # only the extent of the scan itself is used, so that the entries for
+        # complete scans stay valid while data is appended to the file
+        return "%s-%x-%x-%s" % (self._scanid(filespec, scan), scan.stop,
+                                scan.checksum & 0xffffffff, kind)
+
+    def _get(self, filespec, scan, kind, producer):
+        key = self._key(filespec, scan, kind)
+        path = os.path.join(self.directory, key + self.suffix)
+
+        data = self._load(path)
+        if data is None:
+            produced = producer()
+            try:
+                self._store(path, produced)
+                self._removeStale(filespec, scan, kind, path)
+                self._evict()
+            except (IOError, OSError):
+                # cache not writable (permissions, memory full...). the data is
+                # still returned, only not shared
+                return produced
+            data = self._load(path)
+            if data is None:
+                # entry did not fit in the cache
+                data = produced
+
+        return data
+
+    def _load(self, path):
+        try:
+            data = numpy.load(path, mmap_mode="r")
+            # keep track of usage for eviction
+            os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            return None
+        return data
+
+    def _store(self, path, data):
+        # write to a temporary file and rename so that other processes
+        # never map a partially written entry
+        fd, tmppath = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            ofd = os.fdopen(fd, "wb")
+            try:
+                numpy.save(ofd, numpy.ascontiguousarray(data))
+            finally:
+                ofd.close()
+            os.rename(tmppath, path)
+        except:
+            self._remove(tmppath)
+            raise
+
+    def _removeStale(self, filespec, scan, kind, current):
+        # entries for the same scan with a previous extent (scan still growing)
+        prefix = self._scanid(filespec, scan) + "-"
+        ending = "-" + kind + self.suffix
+        for size, mtime, path in self._entries():
+            name = os.path.basename(path)
+            if path != current and name.startswith(prefix) and name.endswith(ending):
+                self._remove(path)
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.suffix):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_size, stat.st_mtime, path))
+        return entries
+
+    def _evict(self):
+        entries = self._entries()
+        total = sum([entry[0] for entry in entries])
+
+        if total <= self.maxsize:
+            return
+
+        # least recently used first
+        entries.sort(key=lambda entry: entry[1])
+        for size, mtime, path in entries:
+            if total <= self.maxsize:
+                break
+            self._remove(path)
+            total -= size
+
+    def _remove(self, path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+# statistics are stored as a structured array with one field per data column
+# and one row per statistic. missing values (columns with only NaN) are NaN
+STATISTICS = ['min', 'max', 'sum', 'mean', 'argmax', 'nan']
+INT_STATISTICS = ['argmax', 'nan']
+
+
+def _statisticsArray(stats):
+    if not stats:
+        return numpy.empty(0)
+
+    fields = numpy.dtype([(str(name), numpy.float64) for name in stats])
+    data = numpy.empty(len(STATISTICS), dtype=fields)
+    for name, colstats in stats.items():
+        data[str(name)] = [numpy.nan if colstats[key] is None else colstats[key] for key in STATISTICS]
+    return data
+
+
+def _statisticsDict(data):
+    stats = {}
+    for name in data.dtype.names or ():
+        colstats = {}
+        for key, value in zip(STATISTICS, data[name].tolist()):
+            if value != value:
+                value = None
+            elif key in INT_STATISTICS:
+                value = int(value)
+            colstats[key] = value
+        stats[name] = colstats
+    return stats
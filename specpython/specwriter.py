@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+#******************************************************************************
+#
+#  %W%  %G% CSS
+#
+#  "splot" Release %R%
+#
+#  Copyright (c) 2013,2014,2015,2016
+#  by Certified Scientific Software.
+#  All rights reserved.
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a
+#  copy of this software ("splot") and associated documentation files (the
+#  "Software"), to deal in the Software without restriction, including
+#  without limitation the rights to use, copy, modify, merge, publish,
+#  distribute, sublicense, and/or sell copies of the Software, and to
+#  permit persons to whom the Software is furnished to do so, subject to
+#  the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  Neither the name of the copyright holder nor the names of its contributors
+#  may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#     * The software is provided "as is", without warranty of any   *
+#     * kind, express or implied, including but not limited to the  *
+#     * warranties of merchantability, fitness for a particular     *
+#     * purpose and noninfringement.  In no event shall the authors *
+#     * or copyright holders be liable for any claim, damages or    *
+#     * other liability, whether in an action of contract, tort     *
+#     * or otherwise, arising from, out of or in connection with    *
+#     * the software or the use of other dealings in the software.  *
+#
+#******************************************************************************
+
+
+"""
+
+****************
+specwriter
+****************
+
+Description
+****************
+   This module writes files in the spec data file format, with the same structure 
+   as the files read by the filespec module: file headers, scan headers, data 
+   points and MCA spectra (@A lines with continuation lines).
+
+   Output is buffered and written by complete points so that a reader following 
+   the file (FileSpec.update()) never finds a partially written point.
+
+Example
+****************
+   from specpython.specwriter import SpecWriter
+
+   with SpecWriter("sim.dat") as writer:
+       writer.writeHeader(motors=["Two Theta", "Theta"], user="sim")
+       writer.startScan(1, "ascan th 0 1 10 1", ["Theta", "Monitor", "Detector"],
+                        motor_positions=[20.0, 10.0], count_time=1)
+       for point in range(11):
+           writer.addPoint([point * 0.1, 1000, 3 * point])
+       writer.endScan()
+
+"""
+
+import time
+
+# number of names or values in each #O, #o, #J, #j and #P line
+ITEMS_PER_LINE = 8
+
+
+class SpecWriter:
+    """
+    Writer for files in the spec data file format
+    """
+
+    def __init__(self, filename, append=False, flush_every=1, mca_width=16):
+        """
+        `flush_every` is the number of data points kept in the buffer before writing them to 
+        the file. `mca_width` is the number of channel values in each @A line
+        """
+        if append:
+            self.fd = open(filename, "a")
+        else:
+            self.fd = open(filename, "w")
+
+        self.filename = filename
+        self.flush_every = flush_every
+        self.mca_width = mca_width
+
+        self._buffer = []
+        self._pending = 0
+        self._columns = 0
+        self._inscan = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, text):
+        self._buffer.append(text)
+
+    def flush(self):
+        if self._buffer:
+            self.fd.write("".join(self._buffer))
+            self._buffer = []
+        self._pending = 0
+        self.fd.flush()
+
+    def close(self):
+        # closing more than once has no effect, as for file objects
+        if self.fd.closed:
+            return
+        if self._inscan:
+            self.endScan()
+        self.flush()
+        self.fd.close()
+
+    def writeHeader(self, filename=None, epoch=None, date=None, spec="spec", user="", 
+                    motors=(), motor_mnes=(), counters=(), counter_mnes=(), comments=()):
+        """
+        Writes a file header block (#F #E #D #C #O #o #J #j lines)
+        """
+        if self._inscan:
+            self.endScan()
+
+        if filename is None:
+            filename = self.filename
+        if epoch is None:
+            epoch = int(time.time())
+        if date is None:
+            date = time.ctime(epoch)
+
+        self.write("#F %s\n#E %d\n#D %s\n" % (filename, epoch, date))
+        self.write("#C %s  User = %s\n" % (spec, user))
+        for comment in comments:
+            self.write("#C %s\n" % comment)
+
+        # names can contain spaces, so they are separated by two spaces
+        self._writeItems("O", motors, "  ")
+        self._writeItems("o", motor_mnes, " ")
+        self._writeItems("J", counters, "  ")
+        self._writeItems("j", counter_mnes, " ")
+        self.write("\n")
+        self.flush()
+
+    def startScan(self, number, command, labels, date=None, count_time=None, units="Seconds",
+                  motor_positions=(), hkl=None, mca_channels=None, mca_names=()):
+        """
+        Writes a scan header block (#S #D #T #P #Q #@ #N #L lines). Data points for the scan 
+        are written with addPoint/addPoints
+        """
+        if self._inscan:
+            self.endScan()
+
+        if date is None:
+            date = time.ctime()
+
+        self.write("#S %d  %s\n#D %s\n" % (number, command, date))
+        if count_time is not None:
+            self.write("#T %s  (%s)\n" % (count_time, units))
+        self._writeItems("P", ["%.12g" % pos for pos in motor_positions], " ")
+        if hkl is not None:
+            self.write("#Q %s\n" % " ".join(["%.12g" % val for val in hkl]))
+
+        if mca_channels:
+            self.write("#@MCA %dC\n#@CHANN %d 0 %d 1\n" % (self.mca_width, mca_channels, mca_channels - 1))
+            for det_no, name in enumerate(mca_names):
+                self.write("#@DET_%d %s\n" % (det_no, name))
+
+        self._columns = len(labels)
+        self.write("#N %d\n#L %s\n" % (self._columns, "  ".join(labels)))
+
+        self._inscan = True
+        self.flush()
+
+    def addPoint(self, values, mcas=()):
+        """
+        Adds a data point to the current scan. `mcas` is a list of spectra (one per 1D detector)
+        written after the data line
+        """
+        if not self._inscan:
+            raise ValueError("no scan started")
+        if len(values) != self._columns:
+            raise ValueError("wrong number of values for point (%d instead of %d)" % (len(values), self._columns))
+
+        self.write(" ".join(["%.12g" % val for val in values]) + "\n")
+        for mca in mcas:
+            self.addMca(mca)
+
+        self._pending += 1
+        if self._pending >= self.flush_every:
+            self.flush()
+
+    def addPoints(self, rows):
+        """
+        Adds several data points (a sequence of rows or a 2D numpy array) to the current scan
+        """
+        for row in rows:
+            self.addPoint(row)
+
+    def addMca(self, values):
+        """
+        Writes one spectrum as an @A line, split in continuation lines of `mca_width` values
+        """
+        values = ["%.12g" % val for val in values]
+        width = self.mca_width
+        lines = [" ".join(values[idx:idx + width]) for idx in range(0, len(values), width)]
+        self.write("@A " + "\\\n".join(lines) + "\n")
+
+    def addComment(self, comment):
+        self.write("#C %s\n" % comment)
+
+    def endScan(self):
+        """
+        Closes the current scan
+        """
+        self.write("\n")
+        self._inscan = False
+        self.flush()
+
+    def _writeItems(self, key, items, sep):
+        items = list(items)
+        for lineno, idx in enumerate(range(0, len(items), ITEMS_PER_LINE)):
+            self.write("#%s%d %s\n" % (key, lineno, sep.join(items[idx:idx + ITEMS_PER_LINE])))